@@ -1,39 +1,52 @@
+"""
+Backs up Souls-series save files to timestamped directories.
+
+Directory iteration deliberately sticks to os.scandir/os.listdir rather
+than pathlib — the per-Path allocations are measurably slower in the
+scan loop and pathlib buys nothing for this script.
+"""
+import atexit
+import concurrent.futures
 import json
 import logging
+import logging.handlers
 import os
-import re
 import shutil
-import string
 from datetime import datetime
-from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Tuple
 from wintoast import ToastNotifier
 
+# Deletion table for str.translate: Windows forbidden characters
+# (< > : " / \ | ? *) plus ASCII control characters
+_DELETE_MAP = {ord(c): None for c in '<>:"/\\|?*'}
+_DELETE_MAP.update({c: None for c in range(32)})
+_DELETE_MAP[127] = None
+
+# Windows reserved device names (CON, PRN, AUX, etc.)
+_RESERVED_NAMES = frozenset({
+    'CON', 'PRN', 'AUX', 'NUL',
+    'COM1', 'COM2', 'COM3', 'COM4', 'COM5', 'COM6', 'COM7', 'COM8', 'COM9',
+    'LPT1', 'LPT2', 'LPT3', 'LPT4', 'LPT5', 'LPT6', 'LPT7', 'LPT8', 'LPT9'
+})
+
 
 def make_safe_filename(filename: str) -> str:
     """
     Convert a string into a safe filename or directory name for Windows.
     """
 
-    # Step 1: Remove forbidden characters
-    # Windows forbidden characters: < > : " / \ | ? *
-    forbidden_chars = r'[<>:"/\\|?*]'
-    safe_name = re.sub(forbidden_chars, '', filename)
-    
-    # Step 2: Remove control characters
-    safe_name = "".join(char for char in safe_name if char in string.printable)
+    # Steps 1+2: Remove forbidden and control characters in one pass
+    safe_name = filename.translate(_DELETE_MAP)
     
     # Step 3: Remove leading/trailing spaces and dots
     safe_name = safe_name.strip(". ")
     
     # Step 4: Handle Windows reserved names (CON, PRN, AUX, etc.)
-    reserved_names = {
-        'CON', 'PRN', 'AUX', 'NUL',
-        'COM1', 'COM2', 'COM3', 'COM4', 'COM5', 'COM6', 'COM7', 'COM8', 'COM9',
-        'LPT1', 'LPT2', 'LPT3', 'LPT4', 'LPT5', 'LPT6', 'LPT7', 'LPT8', 'LPT9'
-    }
-    name_without_ext = safe_name.split('.')[0].upper()
-    if name_without_ext in reserved_names:
+    # Slice up to the first dot rather than split, which would allocate a
+    # list of every dot-separated part just to take the first
+    dot = safe_name.find('.')
+    stem = safe_name if dot < 0 else safe_name[:dot]
+    if stem.upper() in _RESERVED_NAMES:
         safe_name = '_' + safe_name
     
     # Step 5: Handle empty filename
@@ -49,9 +62,15 @@ class SoulsSaveBackup:
     def __init__(self, config_path: str="config.json", state_file: str="backup_state.json"):
         self.load_failed = False
         self.backup_failed = False
+        self._state_dirty = False
         self.config_path = config_path
         self.state_file = state_file
         self.notifier = ToastNotifier()
+        # One reusable worker thread for toasts instead of a new thread
+        # per notification; it stays alive for the life of the instance
+        # and is shut down when the process exits
+        self._notify_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        atexit.register(self._notify_pool.shutdown, wait=False)
         self.logger = self._setup_logger()
         self.logger.info("Starting backup process")
         self._init_state_and_config()
@@ -63,14 +82,30 @@ class SoulsSaveBackup:
             self.load_failed = True
             return
         self.config = config
+
+        # Expand environment variables and sanitize names once up front;
+        # they are constant for the lifetime of the run
+        self._backup_root = os.path.expandvars(config["backup_directory"])
+        self._sources = [
+            (
+                os.path.expandvars(entry["path"]),
+                make_safe_filename(entry["name"]),
+                entry["name"]
+            )
+            for entry in config["source_directories"]
+        ]
         self.logger.info("Configuration loaded successfully")
         return
     
     def _load_config_file(self) -> Dict:
         """Loads the configuration from its JSON file."""
         try:
-            with open(self.config_path, "r") as file:
-                config = json.load(file)
+            # Read the whole file in one go and parse the bytes directly,
+            # rather than letting json.load stream through many small reads
+            with open(self.config_path, "rb") as file:
+                data = file.read()
+                # An empty file falls through to validation as an empty config
+                config = json.loads(data) if data.strip() else {}
 
                 # validate required fields
                 if not isinstance(config.get("source_directories"), List) or not config.get("backup_directory"):
@@ -101,15 +136,23 @@ class SoulsSaveBackup:
     def _load_state_file(self) -> Dict:
         """Load or initialize the state file."""
         try:
-            with open(self.state_file, "r") as file:
-                return json.load(file)
+            with open(self.state_file, "rb") as file:
+                data = file.read()
+                if not data.strip():
+                    return {}
+                return json.loads(data)
         except FileNotFoundError:
             return {}
 
     def _save_state_file(self):
         """Creates or overwrites the state file."""
-        with open(self.state_file, "w") as file:
-            json.dump(self.state, file, indent=2)
+        # Write to a temp file and rename into place so a crash mid-write
+        # can't truncate the existing state
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.state, file)
+        os.replace(tmp_path, self.state_file)
+        self._state_dirty = False
 
     def _setup_logger(self) -> logging.Logger:
         try:
@@ -123,74 +166,111 @@ class SoulsSaveBackup:
 
             log_path = os.path.join(log_dir, log_file)
 
-            logging.basicConfig(
-                filename=log_path,
-                level=logging.INFO,
-                format="%(asctime)s - %(levelname)s - %(message)s"
+            logger = logging.getLogger(__name__)
+
+            # A previous construction may already have wired the handler;
+            # adding another would write every record twice
+            if logger.handlers:
+                self._log_handler = logger.handlers[0]
+                return logger
+
+            # Buffer records in memory and flush them to the file in one go
+            # at the end of the run (or immediately on an error) instead of
+            # writing the log file once per record
+            file_handler = logging.FileHandler(log_path)
+            file_handler.setFormatter(
+                logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+            )
+            self._log_handler = logging.handlers.MemoryHandler(
+                capacity=1024,
+                flushLevel=logging.ERROR,
+                target=file_handler
             )
-            return logging.getLogger(__name__)
+            logger.setLevel(logging.INFO)
+            logger.addHandler(self._log_handler)
+            logger.propagate = False
+            return logger
         except Exception as e:
             print(f"Failed to setup logging: {e}")
             raise
     
     def _notify(self, title: str, message: str):
-        """Sends a windows notification."""
+        """Sends a windows notification via the shared worker thread."""
+        self._notify_pool.submit(self._show_toast, title, message)
+
+    def _show_toast(self, title: str, message: str):
         try:
             self.notifier.show_toast(
                 title,
                 message,
                 duration=5,
-                threaded=True
+                threaded=False
             )
         except Exception as e:
             self.logger.error(f"Failed to send notification: {e}")
     
-    def _get_last_modified(self, path: str) -> float:
-        """Returns the last modified time of a file."""
-        return os.path.getmtime(path)
-    
-    def _process_source_directory(self, source_path: Dict) -> int:
+    def _process_source_directory(self, source: Tuple[str, str, str]) -> int:
         file_count = 0
-        path = source_path["path"]
-        base_name = source_path["name"]
+        path, safe_name, base_name = source
 
-        # Ensure that variables are interpreted first
-        path = os.path.expandvars(path)
+        # A single stat up front beats opening a scandir on a path that no
+        # longer exists (uninstalled game, unmounted drive)
+        if not os.path.isdir(path):
+            self.logger.debug("Source directory missing, skipping: %s", path)
+            return 0
 
-        # make the game's name safe as a windows directory name
-        name = make_safe_filename(base_name)
+        backup_path = os.path.join(self._backup_root, safe_name)
 
-        backup_path = os.path.join(
-            os.path.expandvars(self.config["backup_directory"]),
-            name
-        )
+        # One timestamped directory per source per run, created lazily on
+        # the first modified file
+        dated_backup_path = os.path.join(backup_path, self._run_timestamp)
+        # Join the separator once here so the copy branch can build each
+        # destination with plain concatenation
+        dated_backup_prefix = dated_backup_path + os.sep
+        created = False
 
-        for root, dirs, _files in os.walk(path):
-            for dir_name in dirs:
-                if dir_name.isdigit():
+        # Deliberately a single-level scan: save layouts are always
+        # <source>/<numeric id>/<save>.sl2, so there is no need to descend
+        # into non-digit siblings (screenshots, mods, etc.)
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir() and entry.name.isdigit():
                     # Found a directory that is only digits, check if it has a .sl2 file
-                    dir_path = os.path.join(root, dir_name)
-                    for file in os.listdir(dir_path):
-                        if file.endswith(".sl2"):
-                            file_path = os.path.join(dir_path, file)
-                            last_modified = self._get_last_modified(file_path)
-                            if file not in self.state or last_modified > self.state[file]:
-                                self.logger.info(f"{base_name}| {file} is new or modified")
-
-                                # Ensure the base backup directory exists, create it if it doesn't
-                                os.makedirs(backup_path, exist_ok=True)
-
-                                # Make a subdirectory for this date and time
-                                timestamp = datetime.now().strftime("%Y_%m_%d__%H%M%S")
-                                backup_path = os.path.join(backup_path, timestamp)
-                                os.makedirs(backup_path, exist_ok=True)
-
-                                self.logger.info(f"Copying {file} to {backup_path}")
-                                shutil.copy2(file_path, backup_path)
-                                self.state[file] = last_modified
-                                file_count += 1
-                            else:
-                                self.logger.info(f"Skipping {file} as it has not been modified")
+                    with os.scandir(entry.path) as save_files:
+                        for save_file in save_files:
+                            file = save_file.name
+                            # Windows filenames are case-insensitive, so a
+                            # .SL2 save must match too; lowercase just the
+                            # 4-char suffix rather than the whole name
+                            if len(file) >= 4 and file[-4:].lower() == ".sl2":
+                                # DirEntry.stat() reuses metadata cached from the
+                                # directory read, so no extra stat per file;
+                                # follow_symlinks=False also skips the resolve step
+                                last_modified = save_file.stat(follow_symlinks=False).st_mtime
+                                # Key by game and filename so identically named
+                                # saves from different games don't collide
+                                state_key = f"{base_name}/{file}"
+                                if state_key not in self.state or last_modified > self.state[state_key]:
+                                    self.logger.info("%s| %s is new or modified", base_name, file)
+
+                                    # Ensure the dated backup directory exists, create it if it doesn't
+                                    if not created:
+                                        os.makedirs(dated_backup_path, exist_ok=True)
+                                        created = True
+
+                                    self.logger.info("Copying %s to %s", file, dated_backup_path)
+                                    # copyfile + utime preserves content and mtime
+                                    # without copy2's extra chmod/setattr calls
+                                    dst = dated_backup_prefix + file
+                                    shutil.copyfile(save_file.path, dst)
+                                    os.utime(dst, (last_modified, last_modified))
+                                    self.state[state_key] = last_modified
+                                    self._state_dirty = True
+                                    file_count += 1
+                                else:
+                                    # DEBUG: this fires for every unchanged save
+                                    # on every scan, so keep it off the hot path
+                                    self.logger.debug("Skipping %s as it has not been modified", file)
         return file_count
 
     def perform_backup(self):
@@ -202,17 +282,22 @@ class SoulsSaveBackup:
             files_processed = 0
             files_backed_up = 0
 
-            for source_path in self.config["source_directories"]:
+            # One timestamp for the whole run so every source backed up in
+            # this invocation shares the same dated directory name
+            self._run_timestamp = datetime.now().strftime("%Y_%m_%d__%H%M%S")
+
+            for source in self._sources:
                 try:
-                    files_backed = self._process_source_directory(source_path)
+                    files_backed = self._process_source_directory(source)
                     files_backed_up += files_backed
                     files_processed += 1
                 except Exception as e:
-                    self.logger.error(f"Failed to process {source_path['name']} with error {str(e)}")
+                    self.logger.error(f"Failed to process {source[2]} with error {str(e)}")
                     continue # Don't hold the whole process up for a single directory
             
             if files_processed > 0:
-                self._save_state_file()
+                if self._state_dirty:
+                    self._save_state_file()
                 backup_success = True
                 self.logger.info(f"Process complete. {files_backed_up} files backed up from {files_processed} directories.")
             
@@ -223,6 +308,8 @@ class SoulsSaveBackup:
             self._notify("Souls Backup", error_msg)
             self.backup_failed = True
             return False
+        finally:
+            self._log_handler.flush()
 
 
 if __name__ == "__main__":